@@ -1,15 +1,23 @@
+import gzip
+import hashlib
+import json
 import os
+import pickle
 import re
 import ipaddress
+import threading
 import time
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Dict, Set, List, Tuple, Any
 
+import numpy as np
 import requests
 import yaml
-from fastapi import FastAPI, Query
-from fastapi.responses import PlainTextResponse, HTMLResponse
+from fastapi import FastAPI, Header, Query, Response
+from fastapi.responses import PlainTextResponse, HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 
 app = FastAPI(title="blocklist-compiler")
 
@@ -22,10 +30,26 @@ GLOBAL_COMMENT = os.getenv("GLOBAL_COMMENT", "compiled-blocklist")
 
 AGGREGATE_THRESHOLD = int(os.getenv("AGGREGATE_THRESHOLD", "50"))
 FETCH_TIMEOUT = int(os.getenv("FETCH_TIMEOUT", "20"))
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "16"))
 CACHE_TTL = int(os.getenv("CACHE_TTL", "600"))
 
+# Shared session so repeated fetches reuse TCP/TLS connections; the pool is
+# sized for the fetch fan-out so parallel workers never wait on a connection.
+SESSION = requests.Session()
+_adapter = requests.adapters.HTTPAdapter(
+    pool_connections=max(FETCH_WORKERS, 1), pool_maxsize=max(FETCH_WORKERS, 1)
+)
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+
 _custom_cache: Dict[Tuple[str, str, Tuple[int, ...], Tuple[str, ...]], Dict[str, object]] = {}
 
+# bindings libyaml si disponibles : 10-20x plus rapide que le loader pur Python
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:  # pragma: no cover - depends on how PyYAML was built
+    from yaml import SafeLoader as _YamlLoader
+
 
 def _normalize_bool(v: Any) -> bool:
     if isinstance(v, bool):
@@ -40,7 +64,7 @@ def _normalize_bool(v: Any) -> bool:
 def load_sources_from_yaml() -> List[dict]:
     try:
         with open(LISTS_PATH, "r", encoding="utf-8") as f:
-            data = yaml.safe_load(f) or {}
+            data = yaml.load(f, Loader=_YamlLoader) or {}
     except FileNotFoundError:
         print(f"[WARN] lists.yaml not found at {LISTS_PATH}, no sources loaded.")
         return []
@@ -99,18 +123,62 @@ def load_sources_from_yaml() -> List[dict]:
     return sources
 
 
+def _lists_mtime() -> float:
+    try:
+        return os.path.getmtime(LISTS_PATH)
+    except OSError:
+        return 0.0
+
+
 ALL_SOURCES: List[dict] = load_sources_from_yaml()
+_lists_loaded_mtime: float = _lists_mtime()
+
+_active_sources_cache: List[dict] | None = None
+_id_index_cache: Dict[int, dict] | None = None
+
+
+def invalidate_sources_cache() -> None:
+    global _active_sources_cache, _id_index_cache
+    _active_sources_cache = None
+    _id_index_cache = None
+    # le HTML d'index rendu dépend des sources, il est invalidé avec elles
+    _index_cache["html"] = None
 
 
 def get_active_sources() -> List[dict]:
-    return [s for s in ALL_SOURCES if _normalize_bool(s.get("is_active", True))]
+    # Le filtrage est recalculé uniquement après (re)chargement de lists.yaml.
+    global _active_sources_cache
+    if _active_sources_cache is None:
+        _active_sources_cache = [
+            s for s in ALL_SOURCES if _normalize_bool(s.get("is_active", True))
+        ]
+    return _active_sources_cache
+
+
+def get_sources_by_id() -> Dict[int, dict]:
+    global _id_index_cache
+    if _id_index_cache is None:
+        _id_index_cache = {int(s["id"]): s for s in get_active_sources()}
+    return _id_index_cache
+
+
+def reload_sources_if_changed() -> bool:
+    """Re-parse lists.yaml, but only if its mtime changed since the last load."""
+    global ALL_SOURCES, _lists_loaded_mtime
+    mtime = _lists_mtime()
+    if mtime == _lists_loaded_mtime:
+        return False
+    ALL_SOURCES = load_sources_from_yaml()
+    _lists_loaded_mtime = mtime
+    invalidate_sources_cache()
+    return True
 
 
 def load_yaml_whitelist() -> List[ipaddress.IPv4Network]:
     nets: List[ipaddress.IPv4Network] = []
     try:
         with open(WHITELIST_PATH, "r", encoding="utf-8") as f:
-            data = yaml.safe_load(f) or {}
+            data = yaml.load(f, Loader=_YamlLoader) or {}
     except FileNotFoundError:
         print(f"[INFO] No whitelist.yaml found at {WHITELIST_PATH}, skipping.")
         return []
@@ -152,52 +220,369 @@ def load_yaml_whitelist() -> List[ipaddress.IPv4Network]:
 YAML_WHITELIST_NETS: List[ipaddress.IPv4Network] = load_yaml_whitelist()
 
 
-def fetch_list(url: str) -> str:
+# État HTTP par URL (ETag / Last-Modified / dernier corps reçu) pour les
+# requêtes conditionnelles : une source inchangée coûte un 304 sans payload.
+# Persisté dans CONFIG_DIR pour que les redémarrages repartent en 304.
+_HTTP_CACHE_PATH = os.path.join(CONFIG_DIR, "http_cache.pkl")
+_http_cache_lock = threading.Lock()
+
+
+def _load_http_cache() -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(_HTTP_CACHE_PATH, "rb") as f:
+            data = pickle.load(f)
+        if isinstance(data, dict):
+            print(f"[INFO] Restored HTTP cache state for {len(data)} URLs.")
+            return data
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"[WARN] Failed to load HTTP cache ({_HTTP_CACHE_PATH}): {e}")
+    return {}
+
+
+def _save_http_cache() -> None:
+    try:
+        tmp_path = _HTTP_CACHE_PATH + ".tmp"
+        with _http_cache_lock:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(_http_cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, _HTTP_CACHE_PATH)
+    except Exception as e:
+        print(f"[WARN] Failed to persist HTTP cache ({_HTTP_CACHE_PATH}): {e}")
+
+
+_http_cache: Dict[str, Dict[str, Any]] = _load_http_cache()
+
+
+# le parsing se fait par lots de cet ordre de grandeur : la RSS d'un fetch
+# reste O(lot) même sur des flux de centaines de Mo
+_PARSE_BATCH = 1 << 20
+
+
+def fetch_parse_ipv4s(url: str, delimiter: str) -> Tuple[np.ndarray | None, bytes | None]:
+    """Stream a source and parse it into a uint32 array on the fly.
+
+    The body is consumed in ~1 MiB line-aligned batches (hashed as it
+    streams), so the full text is never held in memory. Returns
+    (ips, body_sha1); (None, None) means 304 Not Modified, and a fetch
+    error yields an empty array like the old skip-on-error behavior.
+    """
     try:
         timeout = FETCH_TIMEOUT
         if timeout <= 0:
             timeout = 5
-        resp = requests.get(url, timeout=timeout)
-        resp.raise_for_status()
-        return resp.text
+
+        headers = {"Accept-Encoding": "gzip, deflate"}
+        cached = _http_cache.get(url)
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        with SESSION.get(url, timeout=timeout, headers=headers, stream=True) as resp:
+            if resp.status_code == 304 and cached:
+                return None, None
+            resp.raise_for_status()
+
+            pattern = _ipv4_pattern(delimiter)
+            sha = hashlib.sha1()
+            chunks: List[np.ndarray] = []
+            pending = b""
+            for chunk in resp.iter_content(chunk_size=65536):
+                if not chunk:
+                    continue
+                sha.update(chunk)
+                pending += chunk
+                if len(pending) >= _PARSE_BATCH:
+                    # découpe sur la dernière fin de ligne pour ne jamais
+                    # couper une adresse en deux
+                    cut = pending.rfind(b"\n")
+                    if cut >= 0:
+                        chunks.append(_blob_to_u32(pending[: cut + 1], pattern))
+                        pending = pending[cut + 1 :]
+                    else:
+                        # lot entier sans fin de ligne (flux pathologique) :
+                        # on vide quand même le tampon pour borner la RSS, en
+                        # gardant une petite queue au cas où une adresse serait
+                        # à cheval sur la coupe
+                        chunks.append(_blob_to_u32(pending[:-64], pattern))
+                        pending = pending[-64:]
+            if pending:
+                chunks.append(_blob_to_u32(pending, pattern))
+
+            _http_cache[url] = {
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+            }
+
+        if not chunks:
+            return np.empty(0, dtype=np.uint32), sha.digest()
+        return np.concatenate(chunks), sha.digest()
     except Exception as e:
         print(f"[WARN] Source skipped (timeout or error): {url} -> {e}")
-        return ""
+        return np.empty(0, dtype=np.uint32), None
 
 
-def extract_ipv4s_from_text(text: str, delimiter: str | None) -> List[ipaddress.IPv4Address]:
-    ips: List[ipaddress.IPv4Address] = []
-    if not delimiter:
-        delimiter = "\n"
+# Cache intermédiaire par source : tableau uint32 déjà parsé, partagé entre
+# toutes les combinaisons de listes (custom/all) pendant CACHE_TTL.
+_parsed_cache: Dict[int, Dict[str, Any]] = {}
 
-    for line in text.splitlines():
-        line = line.strip()
-        if not line:
-            continue
+# Instantané disque du cache parsé : au redémarrage les tableaux sont rechargés
+# depuis CONFIG_DIR/cache et le premier refresh se réduit à des GET
+# conditionnels (304) au lieu de re-télécharger et re-parser chaque flux.
+_DISK_CACHE_DIR = os.path.join(CONFIG_DIR, "cache")
+# au-delà de cet âge un instantané est considéré trop vieux pour être rechargé
+_DISK_CACHE_MAX_AGE = CACHE_TTL * 10
 
-        token = line
-        if delimiter:
-            parts = line.split(delimiter, 1)
-            token = parts[0].strip()
 
-        if not token:
-            continue
+def _src_delimiter(src: dict) -> str:
+    return src.get("delimiter") or "\n"
 
-        try:
-            ip = ipaddress.IPv4Address(token)
-            ips.append(ip)
-            continue
-        except ValueError:
-            pass
 
+def _entry_matches(entry: Dict[str, Any] | None, url: str, delimiter: str) -> bool:
+    """True when a parsed-cache entry was produced from the same feed with the
+    same delimiter; the regex embeds the delimiter, so a delimiter edit in
+    lists.yaml invalidates the array exactly like a URL change."""
+    return (
+        entry is not None
+        and entry.get("url") == url
+        and entry.get("delimiter") == delimiter
+    )
+
+
+def _disk_cache_paths(url: str) -> Tuple[str, str]:
+    stem = os.path.join(_DISK_CACHE_DIR, hashlib.sha1(url.encode("utf-8")).hexdigest())
+    return stem + ".npz", stem + ".json"
+
+
+def _store_disk_cache(
+    url: str, delimiter: str, ips: np.ndarray, body_sha1: bytes | None, ts: float
+) -> None:
+    try:
+        os.makedirs(_DISK_CACHE_DIR, exist_ok=True)
+        npz_path, meta_path = _disk_cache_paths(url)
+        tmp = npz_path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, ips=ips)
+        os.replace(tmp, npz_path)
+        meta = {
+            "url": url,
+            "delimiter": delimiter,
+            "body_sha1": body_sha1.hex() if body_sha1 else None,
+            "ts": ts,
+        }
+        tmp = meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, meta_path)
+    except Exception as e:
+        print(f"[WARN] Failed to write disk cache for {url}: {e}")
+
+
+def _touch_disk_cache(url: str, ts: float) -> None:
+    """Refresh the snapshot timestamp when a feed was revalidated unchanged."""
+    _, meta_path = _disk_cache_paths(url)
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        meta["ts"] = ts
+        tmp = meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, meta_path)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"[WARN] Failed to touch disk cache for {url}: {e}")
+
+
+def _preload_parsed_cache() -> None:
+    """Seed _parsed_cache from disk snapshots left by a previous run."""
+    now = time.time()
+    loaded = 0
+    for src in ALL_SOURCES:
+        url = src["url"]
+        delimiter = _src_delimiter(src)
+        npz_path, meta_path = _disk_cache_paths(url)
         try:
-            iface = ipaddress.IPv4Interface(token)
-            ips.append(iface.ip)
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("url") != url or meta.get("delimiter") != delimiter:
+                # instantané produit avec un autre délimiteur : inutilisable,
+                # le premier refresh refera un parse complet
+                continue
+            ts = float(meta.get("ts", 0.0))
+            if now - ts > _DISK_CACHE_MAX_AGE:
+                continue
+            with np.load(npz_path) as data:
+                ips = np.ascontiguousarray(data["ips"], dtype=np.uint32)
+            sha_hex = meta.get("body_sha1")
+            _parsed_cache[int(src["id"])] = {
+                # ts d'origine conservé : l'entrée reste périmée au sens du
+                # TTL, le prochain refresh fera un GET conditionnel (304)
+                "ts": ts,
+                "url": url,
+                "delimiter": delimiter,
+                "ips": ips,
+                "body_sha1": bytes.fromhex(sha_hex) if sha_hex else None,
+            }
+            loaded += 1
+        except FileNotFoundError:
             continue
-        except ValueError:
-            pass
+        except Exception as e:
+            print(f"[WARN] Ignoring unreadable disk cache for {url}: {e}")
+    if loaded:
+        print(f"[INFO] Preloaded {loaded} parsed source(s) from {_DISK_CACHE_DIR}")
+
+
+_preload_parsed_cache()
+
+
+def get_parsed_ips(selected: List[dict]) -> Dict[int, np.ndarray]:
+    """Return the parsed uint32 IP array per selected source id.
+
+    Stale or missing sources are re-fetched in parallel; fresh entries are
+    served from _parsed_cache so the raw feeds are downloaded and parsed
+    once per CACHE_TTL regardless of how many script variants request them.
+    """
+    now = time.time()
+    stale: List[dict] = []
+    for src in selected:
+        sid = int(src["id"])
+        entry = _parsed_cache.get(sid)
+        if (
+            not _entry_matches(entry, src["url"], _src_delimiter(src))
+            or now - float(entry.get("ts", 0.0)) > CACHE_TTL
+        ):
+            stale.append(src)
+
+    if stale:
+        for src in stale:
+            sid = int(src["id"])
+            entry = _parsed_cache.get(sid)
+            if not _entry_matches(entry, src["url"], _src_delimiter(src)):
+                # pas de tableau réutilisable (redémarrage, URL ou délimiteur
+                # modifié) : un 304 ne servirait à rien, on force un corps
+                # complet
+                _http_cache.pop(src["url"], None)
+
+        workers = max(1, min(FETCH_WORKERS, len(stale)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(
+                executor.map(
+                    lambda s: fetch_parse_ipv4s(s["url"], _src_delimiter(s)),
+                    stale,
+                )
+            )
+
+        for src, (ips, body_sha1) in zip(stale, results):
+            sid = int(src["id"])
+            url = src["url"]
+            delimiter = _src_delimiter(src)
+            if ips is None:
+                # corps inchangé (304) : on garde le tableau déjà parsé
+                _parsed_cache[sid]["ts"] = now
+                _touch_disk_cache(url, now)
+                continue
+
+            entry = _parsed_cache.get(sid)
+            if body_sha1 is None:
+                # fetch en erreur : comme pour le snapshot disque, on ne
+                # remplace pas un tableau sain par un tableau vide. Les
+                # validateurs sont purgés pour qu'un 304 trompeur ne fige
+                # pas l'état une fois la source rétablie.
+                _http_cache.pop(url, None)
+                if _entry_matches(entry, url, delimiter):
+                    # ts rafraîchi : on réessaiera au prochain cycle TTL
+                    entry["ts"] = now
+                    continue
+                _parsed_cache[sid] = {
+                    "ts": now,
+                    "url": url,
+                    "delimiter": delimiter,
+                    "ips": ips,
+                    "body_sha1": None,
+                }
+                continue
+
+            # certaines sources ne renvoient ni ETag ni Last-Modified : on
+            # compare alors le hash du corps pour garder le tableau existant
+            if _entry_matches(entry, url, delimiter) and entry.get("body_sha1") == body_sha1:
+                entry["ts"] = now
+                _touch_disk_cache(url, now)
+                continue
+
+            _parsed_cache[sid] = {
+                "ts": now,
+                "url": url,
+                "delimiter": delimiter,
+                "ips": ips,
+                "body_sha1": body_sha1,
+            }
+            _store_disk_cache(url, delimiter, ips, body_sha1, now)
+
+        # un seul dump par rafraîchissement, pas un par URL
+        _save_http_cache()
+
+    return {int(src["id"]): _parsed_cache[int(src["id"])]["ips"] for src in selected}
+
+
+def u32_to_dotted(value: int) -> bytes:
+    return b"%d.%d.%d.%d" % (
+        (value >> 24) & 255,
+        (value >> 16) & 255,
+        (value >> 8) & 255,
+        value & 255,
+    )
+
+
+@lru_cache(maxsize=131072)
+def fmt_net24(net24: int) -> bytes:
+    """Format a /24 network key; memoized since sources share many prefixes."""
+    return b"%d.%d.%d.0/24" % ((net24 >> 24) & 255, (net24 >> 16) & 255, (net24 >> 8) & 255)
+
+
+_IPV4_RE_CACHE: Dict[str, re.Pattern] = {}
+
+
+def _ipv4_pattern(delimiter: str) -> re.Pattern:
+    """Bytes regex matching a dotted-quad (optionally /0-32) at the start of a
+    line, terminated by the source delimiter or end of line."""
+    pat = _IPV4_RE_CACHE.get(delimiter)
+    if pat is None:
+        # le \r optionnel avant le délimiteur/fin de ligne couvre les flux CRLF
+        pat = re.compile(
+            rb"(?m)^[ \t]*(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})"
+            rb"(?:/(?:3[0-2]|[12]?[0-9]))?"
+            rb"(?=[ \t\r]*(?:" + re.escape(delimiter.encode("utf-8")) + rb"|$))"
+        )
+        _IPV4_RE_CACHE[delimiter] = pat
+    return pat
+
+
+def _blob_to_u32(blob: bytes, pattern: re.Pattern) -> np.ndarray:
+    """One C-level regex sweep over raw bytes, then NumPy converts and
+    validates the octets in bulk."""
+    matches = pattern.findall(blob)
+    if not matches:
+        return np.empty(0, dtype=np.uint32)
+
+    octets = np.array(matches).astype(np.uint32)  # shape (N, 4)
+    valid = (octets <= 255).all(axis=1)
+    octets = octets[valid]
+    return (octets[:, 0] << 24) | (octets[:, 1] << 16) | (octets[:, 2] << 8) | octets[:, 3]
+
+
+def extract_ipv4s_from_text(text: str, delimiter: str | None) -> np.ndarray:
+    """Extract all IPv4 addresses from a feed as a uint32 array."""
+    if not delimiter:
+        delimiter = "\n"
+    return _blob_to_u32(text.encode("ascii", "ignore"), _ipv4_pattern(delimiter))
 
-    return ips
+
+_LIST_NAME_RE = re.compile(r"[^A-Za-z0-9_\-]")
 
 
 def normalize_list_name(raw: str | None) -> str:
@@ -206,12 +591,16 @@ def normalize_list_name(raw: str | None) -> str:
     raw = raw.strip()
     if not raw:
         return MIKROTIK_LIST_NAME
-    cleaned = re.sub(r"[^A-Za-z0-9_\-]", "_", raw)
+    cleaned = _LIST_NAME_RE.sub("_", raw)
     if not cleaned:
         return MIKROTIK_LIST_NAME
     return cleaned[:63]
 
 
+_TIMEOUT_DAYS_RE = re.compile(r"^(\d+)d\s*(\d{1,2}):(\d{2}):(\d{2})$")
+_TIMEOUT_HMS_RE = re.compile(r"^(\d{1,2}):(\d{2}):(\d{2})$")
+
+
 def parse_timeout(raw: str | None) -> str:
     DEFAULT_TIMEOUT = "06:00:00"
     MAX_SECONDS = 3 * 24 * 3600
@@ -224,19 +613,27 @@ def parse_timeout(raw: str | None) -> str:
     days = 0
     h = m = s = 0
 
-    mobj = re.match(r"^(\d+)d\s*(\d{1,2}):(\d{2}):(\d{2})$", txt)
-    if mobj:
-        days = int(mobj.group(1))
-        h = int(mobj.group(2))
-        m = int(mobj.group(3))
-        s = int(mobj.group(4))
-    else:
-        mobj = re.match(r"^(\d{1,2}):(\d{2}):(\d{2})$", txt)
-        if not mobj:
+    # chemin rapide sans regex pour la forme fixe HH:MM:SS (le cas courant)
+    if len(txt) == 8 and txt[2] == ":" and txt[5] == ":":
+        h_part, m_part, s_part = txt[0:2], txt[3:5], txt[6:8]
+        if h_part.isdigit() and m_part.isdigit() and s_part.isdigit():
+            h, m, s = int(h_part), int(m_part), int(s_part)
+        else:
             raise ValueError("Invalid timeout format")
-        h = int(mobj.group(1))
-        m = int(mobj.group(2))
-        s = int(mobj.group(3))
+    else:
+        mobj = _TIMEOUT_DAYS_RE.match(txt)
+        if mobj:
+            days = int(mobj.group(1))
+            h = int(mobj.group(2))
+            m = int(mobj.group(3))
+            s = int(mobj.group(4))
+        else:
+            mobj = _TIMEOUT_HMS_RE.match(txt)
+            if not mobj:
+                raise ValueError("Invalid timeout format")
+            h = int(mobj.group(1))
+            m = int(mobj.group(2))
+            s = int(mobj.group(3))
 
     total = days * 86400 + h * 3600 + m * 60 + s
     if total <= 0 or total > MAX_SECONDS:
@@ -252,6 +649,115 @@ def parse_timeout(raw: str | None) -> str:
         return f"{h:02d}:{m:02d}:{s:02d}"
 
 
+# drapeaux de la table grossière /16 : cellule entièrement blanchie / partielle
+_WL_FULL = 1
+_WL_PARTIAL = 2
+
+
+def build_whitelist_ranges(
+    whitelist_nets: List[ipaddress.IPv4Network],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Build sorted, disjoint (start, end) uint32 interval arrays plus a
+    65536-cell /16 lookup table.
+
+    Overlapping or nested whitelist networks are merged so containment can
+    be decided by locating the nearest interval start with searchsorted.
+    The coarse table marks each /16 cell as fully covered or partially
+    covered, so most IPs are classified with a single indexed load and the
+    interval search only runs on IPs landing in partial cells.
+    """
+    if not whitelist_nets:
+        empty = np.empty(0, dtype=np.uint32)
+        return empty, empty, np.zeros(65536, dtype=np.uint8)
+
+    ranges = sorted(
+        (int(net.network_address), int(net.broadcast_address)) for net in whitelist_nets
+    )
+    merged: List[Tuple[int, int]] = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+
+    coarse = np.zeros(65536, dtype=np.uint8)
+    for start, end in merged:
+        s16, e16 = start >> 16, end >> 16
+        full_lo = s16 + (1 if start & 0xFFFF else 0)
+        full_hi = e16 - (1 if (end & 0xFFFF) != 0xFFFF else 0)
+        if full_lo <= full_hi:
+            coarse[full_lo : full_hi + 1] |= _WL_FULL
+        if start & 0xFFFF:
+            coarse[s16] |= _WL_PARTIAL
+        if (end & 0xFFFF) != 0xFFFF:
+            coarse[e16] |= _WL_PARTIAL
+
+    starts, ends = zip(*merged)
+    return np.array(starts, dtype=np.uint32), np.array(ends, dtype=np.uint32), coarse
+
+
+def filter_whitelisted(
+    ips_arr: np.ndarray,
+    wl_starts: np.ndarray,
+    wl_ends: np.ndarray,
+    wl_coarse: np.ndarray,
+) -> np.ndarray:
+    """Drop every IP covered by a whitelist interval, in one vector pass."""
+    if ips_arr.size == 0 or wl_starts.size == 0:
+        return ips_arr
+
+    tag = wl_coarse[ips_arr >> 16]
+    covered = (tag & _WL_FULL) != 0
+
+    partial = ((tag & _WL_PARTIAL) != 0) & ~covered
+    if partial.any():
+        sub = ips_arr[partial]
+        idx = np.searchsorted(wl_starts, sub, side="right") - 1
+        covered[partial] = (idx >= 0) & (sub <= wl_ends[np.maximum(idx, 0)])
+
+    return ips_arr[~covered]
+
+
+def merge_net24_blocks(
+    nets24_sorted: List[int],
+    whitelist_nets: List[ipaddress.IPv4Network],
+) -> List[Tuple[int, int]]:
+    """Merge ascending /24 network ints into the largest aligned CIDR blocks.
+
+    Classic stack-based CIDR merge: two sibling blocks aligned on their
+    parent boundary collapse into one block with prefix-1, repeatedly.
+    A merge is refused when the candidate supernet would span a whitelist
+    network, so a single address-list entry never covers a whitelisted range.
+    Returns (network, prefixlen) tuples in ascending order.
+    """
+    wl_ranges = [
+        (int(net.network_address), int(net.broadcast_address)) for net in whitelist_nets
+    ]
+
+    def spans_whitelist(start: int, prefix: int) -> bool:
+        end = start | (0xFFFFFFFF >> prefix)
+        return any(start <= ws and we <= end for ws, we in wl_ranges)
+
+    merged: List[Tuple[int, int]] = []
+    for start in nets24_sorted:
+        current = (start, 24)
+        while merged:
+            prev_start, prev_prefix = merged[-1]
+            cur_start, cur_prefix = current
+            if prev_prefix != cur_prefix:
+                break
+            size = 1 << (32 - cur_prefix)
+            if prev_start + size != cur_start or prev_start & (2 * size - 1):
+                break
+            if spans_whitelist(prev_start, cur_prefix - 1):
+                break
+            merged.pop()
+            current = (prev_start, cur_prefix - 1)
+        merged.append(current)
+    return merged
+
+
 def make_error_script() -> str:
     return ':log error "Custom blocklist link is wrong, please check online !"' + "\n"
 
@@ -261,12 +767,11 @@ def compile_custom_blocklist(
     timeout: str,
     source_ids: List[int],
     whitelist_nets: List[ipaddress.IPv4Network],
-) -> str:
+) -> bytes:
     if not source_ids:
         raise ValueError("No sources selected")
 
-    sources = get_active_sources()
-    src_by_id = {int(s["id"]): s for s in sources}
+    src_by_id = get_sources_by_id()
     selected = []
     for sid in source_ids:
         if sid in src_by_id:
@@ -274,96 +779,168 @@ def compile_custom_blocklist(
     if not selected:
         raise ValueError("Unknown sources")
 
-    wl_nets = whitelist_nets or []
+    wl_starts, wl_ends, wl_coarse = build_whitelist_ranges(whitelist_nets or [])
 
-    all_ips: Set[ipaddress.IPv4Address] = set()
-    explicit_nets24: Set[ipaddress.IPv4Network] = set()
-    explicit_nets24_comment: Dict[ipaddress.IPv4Network, str] = {}
-    ip_first_comment: Dict[ipaddress.IPv4Address, str] = {}
+    explicit_nets24: Set[int] = set()
+    explicit_nets24_comment: Dict[int, str] = {}
 
-    # Collecte des IP depuis les sources
-    for src in selected:
-        url = src["url"]
-        delim = src.get("delimiter") or "\n"
+    # Les IP /32 restent des tableaux uint32 ; l'attribution des commentaires
+    # passe par un tableau parallèle d'indices de source (une table de
+    # commentaires par compile), plus aucun dict par IP.
+    comments_table: List[str] = []
+    ip_chunks: List[np.ndarray] = []
+    src_idx_chunks: List[np.ndarray] = []
+
+    # Collecte des IP depuis les sources (fetch+parse mutualisés via le cache)
+    parsed_by_id = get_parsed_ips(selected)
+    for src_idx, src in enumerate(selected):
         cidr_mode = src.get("cidr_mode") or "32"
         source_comment = (src.get("name") or src.get("comment") or GLOBAL_COMMENT).strip() or GLOBAL_COMMENT
+        comments_table.append(source_comment)
 
-        text = fetch_list(url)
-        if not text:
+        ips_arr = parsed_by_id.get(int(src["id"]))
+        if ips_arr is None or ips_arr.size == 0:
             continue
 
-        ips = extract_ipv4s_from_text(text, delim)
+        ips_arr = filter_whitelisted(ips_arr, wl_starts, wl_ends, wl_coarse)
+        if ips_arr.size == 0:
+            continue
 
         if cidr_mode == "24":
             # on agrège directement en /24 explicites
-            for ip in ips:
-                if any(ip in net for net in wl_nets):
-                    continue
-                net = ipaddress.IPv4Network(f"{ip.exploded}/24", strict=False)
-                if net not in explicit_nets24:
-                    explicit_nets24.add(net)
-                    explicit_nets24_comment[net] = source_comment
+            for net24 in np.unique(ips_arr & np.uint32(0xFFFFFF00)).tolist():
+                if net24 not in explicit_nets24:
+                    explicit_nets24.add(net24)
+                    explicit_nets24_comment[net24] = source_comment
         else:
             # mode /32 classique
-            for ip in ips:
-                if any(ip in net for net in wl_nets):
-                    continue
-                if ip not in all_ips:
-                    all_ips.add(ip)
-                    ip_first_comment.setdefault(ip, source_comment)
-
-    # Agrégation en /24 si >= AGGREGATE_THRESHOLD IP dans le /24
-    per_net24: Dict[ipaddress.IPv4Network, Set[ipaddress.IPv4Address]] = defaultdict(set)
-    for ip in all_ips:
-        net24 = ipaddress.IPv4Network(f"{ip.exploded}/24", strict=False)
-        per_net24[net24].add(ip)
-
-    aggregated_nets24: Set[ipaddress.IPv4Network] = set()
-    aggregated_ips: Set[ipaddress.IPv4Address] = set()
-    aggregated_nets24_comment: Dict[ipaddress.IPv4Network, str] = {}
-
-    for net, ips_set in per_net24.items():
-        if len(ips_set) >= AGGREGATE_THRESHOLD:
-            aggregated_nets24.add(net)
-            aggregated_ips.update(ips_set)
-            first_ip = next(iter(ips_set))
-            aggregated_nets24_comment[net] = ip_first_comment.get(first_ip, GLOBAL_COMMENT)
-
-    # IP restantes (non agrégées et non couvertes par des /24 explicites)
-    remaining_ips: Set[ipaddress.IPv4Address] = set()
-    for ip in all_ips:
-        ip_net24 = ipaddress.IPv4Network(f"{ip.exploded}/24", strict=False)
-        if ip_net24 in explicit_nets24:
-            continue
-        if ip_net24 in aggregated_nets24:
-            continue
-        remaining_ips.add(ip)
+            ip_chunks.append(ips_arr)
+            src_idx_chunks.append(np.full(ips_arr.size, src_idx, dtype=np.uint16))
+
+    # Déduplication + agrégation /24, entièrement vectorisées. np.unique
+    # renvoie la première occurrence dans l'ordre de concaténation, donc la
+    # première source sélectionnée garde l'attribution du commentaire.
+    aggregated_nets24: Set[int] = set()
+    aggregated_nets24_comment: Dict[int, str] = {}
+    remaining_arr = np.empty(0, dtype=np.uint32)
+    remaining_src = np.empty(0, dtype=np.uint16)
+
+    if ip_chunks:
+        all_arr = np.concatenate(ip_chunks)
+        all_src = np.concatenate(src_idx_chunks)
+        ips_arr, first_idx = np.unique(all_arr, return_index=True)
+        first_src = all_src[first_idx]
+
+        keys24 = ips_arr >> 8
+        uniq24, first24_idx, counts = np.unique(keys24, return_index=True, return_counts=True)
+        hot_mask = counts >= AGGREGATE_THRESHOLD
+        hot24 = uniq24[hot_mask]
+
+        member_src = first_src[first24_idx[hot_mask]].tolist()
+        for net24, src_idx in zip((hot24 << np.uint32(8)).tolist(), member_src):
+            aggregated_nets24.add(net24)
+            aggregated_nets24_comment[net24] = comments_table[src_idx]
+
+        # IP restantes : un seul test d'appartenance contre l'union des /24
+        # couverts (agrégés + explicites). La fusion CIDR opérant en aval sur
+        # ces mêmes /24, l'union couvre aussi exactement les futurs supernets.
+        covered24 = hot24
+        if explicit_nets24:
+            explicit_keys = (
+                np.fromiter(explicit_nets24, dtype=np.uint32, count=len(explicit_nets24)) >> 8
+            )
+            covered24 = np.concatenate([hot24, explicit_keys])
+        keep_mask = ~np.isin(keys24, covered24)
+        remaining_arr = ips_arr[keep_mask]
+        remaining_src = first_src[keep_mask]
+
+    # Fusion CIDR sur l'ensemble des /24 (agrégés + explicites) : les blocs
+    # contigus alignés deviennent des /23, /22, ... jusqu'à stabilité.
+    all_nets24 = explicit_nets24 | aggregated_nets24
+    nets24_sorted = np.sort(
+        np.fromiter(all_nets24, dtype=np.uint32, count=len(all_nets24))
+    ).tolist()
+    net_blocks = merge_net24_blocks(nets24_sorted, whitelist_nets or [])
+
+    # Regroupement par commentaire : le suffixe ' comment="..." timeout=...'
+    # est composé une fois par groupe, seule l'adresse varie par ligne.
+    nets_by_comment: Dict[str, List[Tuple[int, int]]] = {}
+    for block in net_blocks:
+        start = block[0]
+        if start in explicit_nets24_comment:
+            comment = explicit_nets24_comment[start]
+        else:
+            comment = aggregated_nets24_comment.get(start, GLOBAL_COMMENT)
+        nets_by_comment.setdefault(comment, []).append(block)
 
-    final_nets24: Set[ipaddress.IPv4Network] = set(explicit_nets24) | set(aggregated_nets24)
+    # remaining_arr sort trié de np.unique, l'ordre par adresse est conservé
+    ips_by_comment: Dict[str, List[int]] = {}
+    for ip, src_idx in zip(remaining_arr.tolist(), remaining_src.tolist()):
+        ips_by_comment.setdefault(comments_table[src_idx], []).append(ip)
 
-    lines: List[str] = []
+    # Émission paresseuse : la compilation ne matérialise jamais la liste
+    # complète des lignes, seuls les octets finaux (mis en cache) existent.
+    return b"".join(_iter_script_lines(list_name, timeout, nets_by_comment, ips_by_comment))
 
-    # Un seul /ip firewall address-list en tête, pas de remove
-    lines.append("/ip firewall address-list")
 
-    # /24 d'abord
-    for net in sorted(final_nets24, key=lambda n: (int(n.network_address), n.prefixlen)):
-        if net in explicit_nets24_comment:
-            comment = explicit_nets24_comment[net]
-        else:
-            comment = aggregated_nets24_comment.get(net, GLOBAL_COMMENT)
-        lines.append(
-            f':do {{ add list={list_name} address={net.with_prefixlen} comment="{comment}" timeout={timeout} }} on-error={{}}'
-        )
+def _iter_script_lines(
+    list_name: str,
+    timeout: str,
+    nets_by_comment: Dict[str, List[Tuple[int, int]]],
+    ips_by_comment: Dict[str, List[int]],
+):
+    # tout est composé en bytes : aucune chaîne str à ré-encoder par ligne
+    line_head = b":do { add list=%s address=" % list_name.encode("utf-8")
+    line_tail = b'" timeout=%s } on-error={}\n' % timeout.encode("ascii")
+
+    # Un seul /ip firewall address-list en tête, pas de remove
+    yield b"/ip firewall address-list\n"
+
+    # les réseaux d'abord
+    for comment, blocks in nets_by_comment.items():
+        group_tail = b' comment="' + comment.encode("utf-8") + line_tail
+        for start, prefix in blocks:
+            if prefix == 24:
+                addr = fmt_net24(start)
+            else:
+                addr = u32_to_dotted(start) + b"/%d" % prefix
+            yield line_head + addr + group_tail
 
     # puis les /32 restants
-    for ip in sorted(remaining_ips, key=int):
-        comment = ip_first_comment.get(ip, GLOBAL_COMMENT)
-        lines.append(
-            f':do {{ add list={list_name} address={ip.exploded} comment="{comment}" timeout={timeout} }} on-error={{}}'
-        )
+    for comment, ips_group in ips_by_comment.items():
+        group_tail = b' comment="' + comment.encode("utf-8") + line_tail
+        for ip in ips_group:
+            yield line_head + u32_to_dotted(ip) + group_tail
+
 
-    return "\n".join(lines) + "\n"
+# Anti "thundering herd" : sur cache froid, un seul thread compile une clé
+# donnée, les autres attendent son résultat au lieu de recompiler en parallèle.
+_custom_cache_lock = threading.Lock()
+_custom_inflight: Dict[Tuple, threading.Event] = {}
+
+# Taille maximale du cache de scripts : chaque combinaison distincte de
+# paramètres crée une entrée, on ne doit pas croître indéfiniment.
+CUSTOM_CACHE_MAX = int(os.getenv("CUSTOM_CACHE_MAX", "256"))
+
+
+def _prune_custom_cache(now: float) -> None:
+    if len(_custom_cache) <= CUSTOM_CACHE_MAX:
+        return
+    # d'abord les entrées expirées, puis les plus anciennes
+    for key in [
+        k for k, e in _custom_cache.items() if now - float(e.get("ts", 0.0)) > CACHE_TTL
+    ]:
+        _custom_cache.pop(key, None)
+    while len(_custom_cache) > CUSTOM_CACHE_MAX:
+        oldest = min(_custom_cache.items(), key=lambda kv: kv[1].get("ts", 0.0))[0]
+        _custom_cache.pop(oldest, None)
+
+
+def _get_cached_script(key: Tuple) -> Dict[str, Any] | None:
+    entry = _custom_cache.get(key)
+    if entry and time.time() - float(entry.get("ts", 0.0)) <= CACHE_TTL:
+        return entry
+    return None
 
 
 def get_custom_script_cached(
@@ -371,21 +948,49 @@ def get_custom_script_cached(
     timeout: str,
     source_ids: List[int],
     whitelist_nets: List[ipaddress.IPv4Network],
-) -> str:
+) -> Dict[str, Any]:
+    """Return the cached {"bytes", "gz"} entry for this script variant,
+    compiling (and pre-encoding) it once on miss."""
     key = (
         list_name,
         timeout,
         tuple(sorted(source_ids)),
         tuple(sorted(str(net) for net in whitelist_nets)),
     )
-    now = time.time()
-    entry = _custom_cache.get(key)
-    if entry and now - float(entry.get("ts", 0.0)) <= CACHE_TTL:
-        return entry["data"]
 
-    script = compile_custom_blocklist(list_name, timeout, source_ids, whitelist_nets)
-    _custom_cache[key] = {"ts": now, "data": script}
-    return script
+    entry = _get_cached_script(key)
+    if entry is not None:
+        return entry
+
+    while True:
+        with _custom_cache_lock:
+            entry = _get_cached_script(key)
+            if entry is not None:
+                return entry
+            event = _custom_inflight.get(key)
+            if event is None:
+                event = threading.Event()
+                _custom_inflight[key] = event
+                break
+        # une autre requête compile déjà cette clé : on attend son résultat
+        event.wait()
+
+    try:
+        # la compilation produit directement des bytes ; gzip fait une fois ici
+        script_bytes = compile_custom_blocklist(list_name, timeout, source_ids, whitelist_nets)
+        entry = {
+            "ts": time.time(),
+            "bytes": script_bytes,
+            "gz": gzip.compress(script_bytes, compresslevel=6),
+        }
+        with _custom_cache_lock:
+            _custom_cache[key] = entry
+            _prune_custom_cache(entry["ts"])
+        return entry
+    finally:
+        with _custom_cache_lock:
+            _custom_inflight.pop(key, None)
+        event.set()
 
 
 app.mount("/html", StaticFiles(directory="html"), name="html")
@@ -408,8 +1013,29 @@ DEFAULT_INDEX_TEMPLATE = """<!DOCTYPE html>
 """
 
 
+def _load_index_template() -> str:
+    try:
+        with open("html/index.html", "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return DEFAULT_INDEX_TEMPLATE
+
+
+# template lu une seule fois à l'import ; un changement de template se
+# redéploie avec le conteneur, inutile de stat() le fichier à chaque requête
+_INDEX_TEMPLATE = _load_index_template()
+
+_index_cache: Dict[str, Any] = {"html": None, "sources_key": None}
+
+
 def render_index_html() -> str:
     sources = get_active_sources()
+
+    # Rendu invalidé uniquement si les sources changent (ou via /reload).
+    sources_key = tuple((int(s["id"]), s["name"], s["url"]) for s in sources)
+    if _index_cache["html"] is not None and _index_cache["sources_key"] == sources_key:
+        return _index_cache["html"]
+
     parts: List[str] = []
 
     parts.append("<h2>Available blocklists</h2>")
@@ -460,14 +1086,9 @@ def render_index_html() -> str:
 
     sources_html = "\n".join(parts)
 
-    template = DEFAULT_INDEX_TEMPLATE
-    try:
-        with open("html/index.html", "r", encoding="utf-8") as f:
-            template = f.read()
-    except FileNotFoundError:
-        pass
-
-    return template.replace("{{SOURCES}}", sources_html)
+    html = _INDEX_TEMPLATE.replace("{{SOURCES}}", sources_html)
+    _index_cache.update({"html": html, "sources_key": sources_key})
+    return html
 
 
 @app.get("/health", response_class=PlainTextResponse)
@@ -475,12 +1096,48 @@ def health():
     return "ok\n"
 
 
+@app.post("/reload", response_class=PlainTextResponse)
+def reload_config():
+    """Re-read lists.yaml if it changed on disk (no-op otherwise)."""
+    if reload_sources_if_changed():
+        return "reloaded\n"
+    return "unchanged\n"
+
+
 @app.get("/", response_class=HTMLResponse)
 def index():
     html = render_index_html()
     return HTMLResponse(content=html)
 
 
+def _script_response(
+    entry: Dict[str, Any],
+    accept_encoding: str | None,
+    chunk_size: int = 65536,
+):
+    """Serve a cached script entry, pre-compressed when the client accepts gzip."""
+    # Vary: un cache intermédiaire ne doit jamais resservir le corps gzip à un
+    # client qui ne l'a pas annoncé (fetch RouterOS sans gzip, par exemple)
+    if accept_encoding and "gzip" in accept_encoding.lower():
+        return Response(
+            content=entry["gz"],
+            media_type="text/plain; charset=utf-8",
+            headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"},
+        )
+
+    data = entry["bytes"]
+
+    def chunks():
+        for i in range(0, len(data), chunk_size):
+            yield data[i : i + chunk_size]
+
+    return StreamingResponse(
+        chunks(),
+        media_type="text/plain; charset=utf-8",
+        headers={"Vary": "Accept-Encoding"},
+    )
+
+
 def _parse_whitelist_params(wl_params: List[str]) -> List[ipaddress.IPv4Network]:
     nets: List[ipaddress.IPv4Network] = []
     for entry in wl_params:
@@ -498,11 +1155,12 @@ def _parse_whitelist_params(wl_params: List[str]) -> List[ipaddress.IPv4Network]
 
 
 @app.get("/custom.rsc", response_class=PlainTextResponse)
-def custom_rsc(
+async def custom_rsc(
     list_param: str | None = Query(None, alias="list"),
     timeout_param: str | None = Query(None, alias="timeout"),
     src: List[int] = Query([], alias="src"),
     wl: List[str] = Query([], alias="wl"),
+    accept_encoding: str | None = Header(None),
 ):
     try:
         list_name = normalize_list_name(list_param)
@@ -516,31 +1174,64 @@ def custom_rsc(
         all_wl_nets.extend(YAML_WHITELIST_NETS)
         all_wl_nets.extend(wl_nets_query)
 
-        script = get_custom_script_cached(list_name, timeout, src, all_wl_nets)
-        return PlainTextResponse(content=script, media_type="text/plain; charset=utf-8")
+        # fetch + compilation déportés dans le threadpool : la boucle
+        # événementielle reste libre pendant les téléchargements
+        entry = await run_in_threadpool(
+            get_custom_script_cached, list_name, timeout, src, all_wl_nets
+        )
+        return _script_response(entry, accept_encoding)
     except Exception as e:
         print(f"[custom.rsc] error: {e}")
         err_script = make_error_script()
         return PlainTextResponse(content=err_script, media_type="text/plain; charset=utf-8")
 
 
+# /all.rsc est l'endpoint que les routeurs interrogent en boucle : il est
+# précompilé par un thread de fond pour que les requêtes ne paient jamais
+# une compilation à froid.
+_all_rsc_entry: Dict[str, Any] | None = None
+
+
+def _build_all_rsc_entry() -> Dict[str, Any]:
+    sources = get_active_sources()
+    if not sources:
+        raise ValueError("No active sources configured")
+    all_ids = [int(s) for s in {int(x["id"]) for x in sources}]
+    return get_custom_script_cached(
+        MIKROTIK_LIST_NAME, parse_timeout(None), all_ids, YAML_WHITELIST_NETS
+    )
+
+
+def _refresh_all_rsc_loop() -> None:
+    global _all_rsc_entry
+    while True:
+        try:
+            _all_rsc_entry = _build_all_rsc_entry()
+        except Exception as e:
+            print(f"[WARN] Background all.rsc refresh failed: {e}")
+        time.sleep(max(CACHE_TTL // 2, 30))
+
+
+@app.on_event("startup")
+def _start_all_rsc_refresh() -> None:
+    threading.Thread(target=_refresh_all_rsc_loop, daemon=True).start()
+
+
 @app.get("/mikrotik.rsc", response_class=PlainTextResponse)
-def mikrotik_rsc():
-    return all_rsc()
+async def mikrotik_rsc(accept_encoding: str | None = Header(None)):
+    return await all_rsc(accept_encoding)
 
 
 @app.get("/all.rsc", response_class=PlainTextResponse)
-def all_rsc():
+async def all_rsc(accept_encoding: str | None = Header(None)):
+    global _all_rsc_entry
     try:
-        sources = get_active_sources()
-        if not sources:
-            raise ValueError("No active sources configured")
-        all_ids = [int(s) for s in {int(x["id"]) for x in sources}]
-        list_name = MIKROTIK_LIST_NAME
-        timeout = parse_timeout(None)
-
-        script = get_custom_script_cached(list_name, timeout, all_ids, YAML_WHITELIST_NETS)
-        return PlainTextResponse(content=script, media_type="text/plain; charset=utf-8")
+        entry = _all_rsc_entry
+        if entry is None or time.time() - float(entry.get("ts", 0.0)) > CACHE_TTL:
+            # cas froid uniquement (le thread de fond n'a pas encore tourné)
+            entry = await run_in_threadpool(_build_all_rsc_entry)
+            _all_rsc_entry = entry
+        return _script_response(entry, accept_encoding)
     except Exception as e:
         print(f"[all.rsc] error: {e}")
         err_script = make_error_script()